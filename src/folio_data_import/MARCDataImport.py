@@ -3,25 +3,29 @@ import asyncio
 import glob
 import importlib
 import io
+import itertools
+import json
+import mmap
 import os
 import sys
-from typing import List
+from typing import AsyncIterator, Callable, List, Optional, Set, Tuple
 import uuid
+import warnings
 from contextlib import ExitStack
 import datetime
 from datetime import datetime as dt
 from getpass import getpass
 from pathlib import Path
-from time import sleep
 
 import folioclient
 import httpx
-import inquirer
+from folioclient.FolioClient import HTTPX_TIMEOUT
 import pymarc
-import tabulate
 from humps import decamelize
 from tqdm import tqdm
 
+from folio_data_import._compat import cql_quote, dump_json, run
+
 
 try:
     datetime_utc = datetime.UTC
@@ -29,12 +33,37 @@ except AttributeError:
     datetime_utc = datetime.timezone.utc
 
 
+# Job execution statuses that mean FOLIO has finished processing a job
+JOB_FINISHED_STATUSES = frozenset(("COMMITTED", "ERROR", "CANCELLED", "DISCARDED"))
+
 # The order in which the report summary should be displayed
 REPORT_SUMMARY_ORDERING = {"created": 0, "updated": 1, "discarded": 2, "error": 3}
 
 # Set default timeout and backoff values for HTTP requests when retrying job status and final summary checks
 RETRY_TIMEOUT_START = 1
 RETRY_TIMEOUT_RETRY_FACTOR = 2
+RETRY_TIMEOUT_MAX = 60
+RETRY_MAX_ATTEMPTS = 10
+
+# Gateway errors returned while FOLIO is still assembling the final job summary
+RETRY_STATUS_CODES = frozenset((502, 504))
+
+# Number of times the HTTP transport retries a failed connection before giving up
+HTTP_CONNECT_RETRIES = 2
+
+# Number of seconds to wait between job status checks once all records have been sent
+JOB_STATUS_POLL_INTERVAL = 1
+
+# Number of job status checks in a row that may find no job execution before giving up
+JOB_NOT_FOUND_MAX_POLLS = 30
+
+# Size of the slices scanned at a time when counting records in a MARC file
+RECORD_COUNT_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Write buffer for the bad record and failed batch files, so failure-heavy runs
+# reach the disk in large blocks rather than one small write per record
+REPORT_FILE_BUFFER_SIZE = 1024 * 1024
+
 
 class MARCImportJob:
     """
@@ -51,19 +80,30 @@ class MARCImportJob:
         batch_delay (float): The number of seconds to wait between record batches (default=0).
         consolidate (bool): Consolidate files into a single job. Default is one job for each file.
         no_progress (bool): Disable progress bars (eg. for running in a CI environment).
+        max_in_flight_batches (int): The number of record batches that may be posted to FOLIO
+            at the same time (default=1). With the default, batches are still sent in order, but
+            the next batch is read while the previous one is being posted.
+        job_profiles (list): Job profiles already retrieved from FOLIO (eg. to prompt for a
+            profile), searched for the import profile before FOLIO is queried (default=None).
     """
 
     bad_records_file: io.TextIOWrapper
     failed_batches_file: io.TextIOWrapper
     job_id: str
-    job_import_profile: dict
+    job_import_profile: Optional[dict] = None
+    job_profile_payload: dict
+    records_url: str
+    job_profile_url: str
     pbar_sent: tqdm
     pbar_imported: tqdm
-    http_client: httpx.Client
+    http_client: httpx.AsyncClient
+    batch_semaphore: asyncio.Semaphore
+    pending_batches: Set[asyncio.Task]
     current_file: List[Path]
-    record_batch: List[dict] = []
+    record_batch: List[bytes]
     error_records: int = 0
     last_current: int = 0
+    job_not_found_polls: int = 0
     total_records_sent: int = 0
     finished: bool = False
 
@@ -77,6 +117,8 @@ class MARCImportJob:
         marc_record_preprocessor=None,
         consolidate=False,
         no_progress=False,
+        max_in_flight_batches=1,
+        job_profiles: Optional[List[dict]] = None,
     ) -> None:
         self.consolidate_files = consolidate
         self.no_progress = no_progress
@@ -85,8 +127,15 @@ class MARCImportJob:
         self.import_profile_name = import_profile_name
         self.batch_size = batch_size
         self.batch_delay = batch_delay
-        self.current_retry_timeout = None
         self.marc_record_preprocessor = marc_record_preprocessor
+        self.preprocessor_func = (
+            self.load_marc_record_preprocessor(marc_record_preprocessor)
+            if marc_record_preprocessor
+            else None
+        )
+        self.max_in_flight_batches = max_in_flight_batches
+        self.job_profiles = job_profiles
+        self.record_batch = []
 
     async def do_work(self) -> None:
         """
@@ -100,30 +149,49 @@ class MARCImportJob:
         Returns:
             None
         """
-        with httpx.Client() as http_client, open(
-            self.import_files[0].parent.joinpath(
-                f"bad_marc_records_{dt.now(tz=datetime_utc).strftime('%Y%m%d%H%M%S')}.mrc"
-            ),
-            "wb+",
-        ) as bad_marc_file, open(
-            self.import_files[0].parent.joinpath(
-                f"failed_batches_{dt.now(tz=datetime_utc).strftime('%Y%m%d%H%M%S')}.mrc"
+        # One idle connection per in-flight batch, plus one for job status checks
+        limits = httpx.Limits(
+            max_keepalive_connections=self.max_in_flight_batches + 1,
+            max_connections=max(100, self.max_in_flight_batches + 1),
+        )
+        # Requests use the same timeout and certificate verification as FolioClient's own
+        async with httpx.AsyncClient(
+            timeout=HTTPX_TIMEOUT,
+            transport=httpx.AsyncHTTPTransport(
+                retries=HTTP_CONNECT_RETRIES,
+                limits=limits,
+                verify=self.folio_client.ssl_verify,
             ),
-            "wb+",
-        ) as failed_batches:
-            self.bad_records_file = bad_marc_file
-            print(f"Writing bad records to {self.bad_records_file.name}")
-            self.failed_batches_file = failed_batches
-            print(f"Writing failed batches to {self.failed_batches_file.name}")
+        ) as http_client:
             self.http_client = http_client
-            if self.consolidate_files:
-                self.current_file = self.import_files
-                await self.import_marc_file()
-            else:
-                for file in self.import_files:
-                    self.current_file = [file]
+            self.batch_semaphore = asyncio.Semaphore(self.max_in_flight_batches)
+            self.pending_batches = set()
+            timestamp = dt.now(tz=datetime_utc).strftime("%Y%m%d%H%M%S")
+            with open(
+                self.import_files[0].parent.joinpath(
+                    f"bad_marc_records_{timestamp}.mrc"
+                ),
+                "wb+",
+                buffering=REPORT_FILE_BUFFER_SIZE,
+            ) as bad_marc_file, open(
+                self.import_files[0].parent.joinpath(
+                    f"failed_batches_{timestamp}.mrc"
+                ),
+                "wb+",
+                buffering=REPORT_FILE_BUFFER_SIZE,
+            ) as failed_batches:
+                self.bad_records_file = bad_marc_file
+                print(f"Writing bad records to {self.bad_records_file.name}")
+                self.failed_batches_file = failed_batches
+                print(f"Writing failed batches to {self.failed_batches_file.name}")
+                if self.consolidate_files:
+                    self.current_file = self.import_files
                     await self.import_marc_file()
-            await self.wrap_up()
+                else:
+                    for file in self.import_files:
+                        self.current_file = [file]
+                        await self.import_marc_file()
+                await self.wrap_up()
 
     async def wrap_up(self) -> None:
         """
@@ -135,17 +203,56 @@ class MARCImportJob:
         Returns:
             None
         """
-        self.bad_records_file.seek(0)
-        if not self.bad_records_file.read(1):
-            os.remove(self.bad_records_file.name)
-            print("No bad records found. Removing bad records file.")
-        self.failed_batches_file.seek(0)
-        if not self.failed_batches_file.read(1):
-            os.remove(self.failed_batches_file.name)
-            print("No failed batches. Removing failed batches file.")
+        self.remove_file_if_empty(
+            self.bad_records_file, "No bad records found. Removing bad records file."
+        )
+        self.remove_file_if_empty(
+            self.failed_batches_file, "No failed batches. Removing failed batches file."
+        )
         print("Import complete.")
         print(f"Total records imported: {self.total_records_sent}")
 
+    @staticmethod
+    def remove_file_if_empty(report_file, message) -> None:
+        """
+        Removes a report file that nothing has been written to.
+
+        The files are only ever appended to while they are open, so the current
+        position tells whether anything was written without re-reading the file.
+
+        Args:
+            report_file (io.BufferedRandom): The open report file.
+            message (str): The message to print when the file is removed.
+
+        Returns:
+            None
+        """
+        if not report_file.tell():
+            os.remove(report_file.name)
+            print(message)
+
+    async def folio_get(self, path, timeout=httpx.USE_CLIENT_DEFAULT) -> dict:
+        """
+        Performs a GET request against FOLIO using the job's HTTP client.
+
+        Args:
+            path (str): The API path (and query string) to request.
+            timeout (float): Optional timeout overriding the client default for this request.
+
+        Returns:
+            dict: The decoded JSON response.
+
+        Raises:
+            HTTPError: If the request fails.
+        """
+        response = await self.http_client.get(
+            self.folio_client.okapi_url + path,
+            headers=self.folio_client.okapi_headers,
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        return response.json()
+
     async def get_job_status(self) -> None:
         """
         Retrieves the status of a job execution.
@@ -154,41 +261,38 @@ class MARCImportJob:
             None
 
         Raises:
-            IndexError: If the job execution with the specified ID is not found.
+            HTTPStatusError: If FOLIO returns an error other than 404 for the job execution,
+                or keeps returning 404 for JOB_NOT_FOUND_MAX_POLLS checks in a row.
+            ConnectTimeout: If FOLIO cannot be reached after RETRY_MAX_ATTEMPTS attempts.
         """
-        try:
-            self.current_retry_timeout = (
-                self.current_retry_timeout * RETRY_TIMEOUT_RETRY_FACTOR
-            ) if self.current_retry_timeout else RETRY_TIMEOUT_START
-            job_status = self.folio_client.folio_get(
-                "/metadata-provider/jobExecutions?statusNot=DISCARDED&uiStatusAny"
-                "=PREPARING_FOR_PREVIEW&uiStatusAny=READY_FOR_PREVIEW&uiStatusAny=RUNNING&limit=50"
-            )
-            self.current_retry_timeout = None
-        except httpx.ConnectTimeout:
-            sleep(.25)
-            with httpx.Client(
-                timeout=self.current_retry_timeout,
-                verify=self.folio_client.ssl_verify
-            ) as temp_client:
-                self.folio_client.httpx_client = temp_client
-                return await self.get_job_status()
-        try:
-            status = [
-                job for job in job_status["jobExecutions"] if job["id"] == self.job_id
-            ][0]
-            self.pbar_imported.update(status["progress"]["current"] - self.last_current)
-            self.last_current = status["progress"]["current"]
-        except IndexError:
-            job_status = self.folio_client.folio_get(
-                "/metadata-provider/jobExecutions?limit=100&sortBy=completed_date%2Cdesc&statusAny"
-                "=COMMITTED&statusAny=ERROR&statusAny=CANCELLED"
-            )
-            status = [
-                job for job in job_status["jobExecutions"] if job["id"] == self.job_id
-            ][0]
-            self.pbar_imported.update(status["progress"]["current"] - self.last_current)
-            self.last_current = status["progress"]["current"]
+        retry_timeout = None
+        for attempt in range(RETRY_MAX_ATTEMPTS):
+            try:
+                status = await self.folio_get(
+                    f"/change-manager/jobExecutions/{self.job_id}",
+                    timeout=retry_timeout or httpx.USE_CLIENT_DEFAULT,
+                )
+                break
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 404:
+                    raise
+                self.job_not_found_polls += 1
+                if self.job_not_found_polls >= JOB_NOT_FOUND_MAX_POLLS:
+                    raise
+                # The job execution is not visible yet; check again on the next poll
+                return
+            except httpx.ConnectTimeout:
+                if attempt == RETRY_MAX_ATTEMPTS - 1:
+                    raise
+                retry_timeout = min(
+                    retry_timeout * RETRY_TIMEOUT_RETRY_FACTOR, RETRY_TIMEOUT_MAX
+                ) if retry_timeout else RETRY_TIMEOUT_START
+                await asyncio.sleep(.25)
+        self.job_not_found_polls = 0
+        current = status.get("progress", {}).get("current", self.last_current)
+        self.pbar_imported.update(current - self.last_current)
+        self.last_current = current
+        if status.get("status") in JOB_FINISHED_STATUSES:
             self.finished = True
 
     async def create_folio_import_job(self) -> None:
@@ -201,7 +305,7 @@ class MARCImportJob:
         Raises:
             HTTPError: If there is an error creating the job.
         """
-        create_job = self.http_client.post(
+        create_job = await self.http_client.post(
             self.folio_client.okapi_url + "/change-manager/jobExecutions",
             headers=self.folio_client.okapi_headers,
             json={"sourceType": "ONLINE", "userId": self.folio_client.current_user},
@@ -217,22 +321,54 @@ class MARCImportJob:
             )
             raise e
         self.job_id = create_job.json()["parentJobExecutionId"]
+        job_url = self.folio_client.okapi_url + f"/change-manager/jobExecutions/{self.job_id}"
+        self.records_url = job_url + "/records"
+        self.job_profile_url = job_url + "/jobProfile"
 
     async def get_import_profile(self) -> None:
         """
         Retrieves the import profile with the specified name.
+
+        The profile is looked for in `job_profiles`, if any were provided. Otherwise it is
+        looked up by name with a CQL query, falling back to listing all job profiles if the
+        query is rejected or finds nothing. The profile is only retrieved once per
+        MARCImportJob, even when each file is imported as a separate job.
         """
-        import_profiles = self.folio_client.folio_get(
-            "/data-import-profiles/jobProfiles",
-            "jobProfiles",
-            query_params={"limit": "1000"},
-        )
-        profile = [
+        if self.job_import_profile is not None:
+            return
+        profile_name = self.import_profile_name
+        profiles = [
             profile
-            for profile in import_profiles
-            if profile["name"] == self.import_profile_name
-        ][0]
+            for profile in self.job_profiles or []
+            if profile["name"] == profile_name
+        ]
+        if not profiles:
+            try:
+                import_profiles = self.folio_client.folio_get(
+                    "/data-import-profiles/jobProfiles",
+                    "jobProfiles",
+                    query_params={"query": f"name=={cql_quote(profile_name)}", "limit": "10"},
+                )
+            except httpx.HTTPStatusError:
+                import_profiles = []
+            profiles = [
+                profile
+                for profile in import_profiles
+                if profile["name"] == profile_name
+            ]
+        if not profiles:
+            profiles = [
+                profile
+                for profile in get_job_profiles(self.folio_client)
+                if profile["name"] == profile_name
+            ]
+        profile = profiles[0]
         self.job_import_profile = profile
+        self.job_profile_payload = {
+            "id": profile["id"],
+            "name": profile["name"],
+            "dataType": "MARC",
+        }
 
     async def set_job_profile(self) -> None:
         """
@@ -241,17 +377,10 @@ class MARCImportJob:
         Returns:
             The response from the HTTP request to set the job profile.
         """
-        set_job_profile = self.http_client.put(
-            self.folio_client.okapi_url
-            + "/change-manager/jobExecutions/"
-            + self.job_id
-            + "/jobProfile",
+        set_job_profile = await self.http_client.put(
+            self.job_profile_url,
             headers=self.folio_client.okapi_headers,
-            json={
-                "id": self.job_import_profile["id"],
-                "name": self.job_import_profile["name"],
-                "dataType": "MARC",
-            },
+            json=self.job_profile_payload,
         )
         try:
             set_job_profile.raise_for_status()
@@ -268,6 +397,22 @@ class MARCImportJob:
         """
         Reads the total number of records from the given files.
 
+        Args:
+            files (list): List of files to read.
+
+        Returns:
+            int: The total number of records found in the files.
+        """
+        return self.count_marc_records(files)
+
+    @staticmethod
+    def count_marc_records(files) -> int:
+        """
+        Counts the records in the given files by their record terminators.
+
+        Files are memory-mapped and scanned for record terminators in large slices,
+        falling back to buffered reads for file objects that cannot be mapped.
+
         Args:
             files (list): List of files to read.
 
@@ -276,45 +421,89 @@ class MARCImportJob:
         """
         total_records = 0
         for import_file in files:
-            while True:
-                chunk = import_file.read(1024)
-                if not chunk:
-                    break
-                total_records += chunk.count(b"\x1d")
-            import_file.seek(0)
+            try:
+                with mmap.mmap(
+                    import_file.fileno(), 0, access=mmap.ACCESS_READ
+                ) as mapped_file:
+                    for offset in range(0, len(mapped_file), RECORD_COUNT_CHUNK_SIZE):
+                        total_records += mapped_file[
+                            offset:offset + RECORD_COUNT_CHUNK_SIZE
+                        ].count(b"\x1d")
+            except (OSError, ValueError):
+                # Empty files and in-memory streams cannot be memory-mapped
+                while True:
+                    chunk = import_file.read(RECORD_COUNT_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    total_records += chunk.count(b"\x1d")
+                import_file.seek(0)
         return total_records
 
-    async def process_record_batch(self, batch_payload) -> None:
+    async def process_record_batch(self, batch_payload, record_count) -> None:
         """
         Processes a record batch.
 
         Args:
-            batch_payload (dict): A records payload containing the current batch of MARC records.
+            batch_payload (bytes): A serialized records payload (see `create_batch_payload`).
+            record_count (int): The number of records included in the payload.
         """
-        post_batch = self.http_client.post(
-            self.folio_client.okapi_url
-            + f"/change-manager/jobExecutions/{self.job_id}/records",
-            headers=self.folio_client.okapi_headers,
-            json=batch_payload,
-        )
         try:
+            headers = httpx.Headers(self.folio_client.okapi_headers)
+            headers["content-type"] = "application/json"
+            post_batch = await self.http_client.post(
+                self.records_url,
+                headers=headers,
+                content=batch_payload,
+            )
             post_batch.raise_for_status()
-            self.total_records_sent += len(self.record_batch)
-            self.record_batch = []
-            self.pbar_sent.update(len(batch_payload["initialRecords"]))
+            self.total_records_sent += record_count
+            self.pbar_sent.update(record_count)
         except Exception as e:
             print("Error posting batch: " + str(e))
-            for record in self.record_batch:
-                self.failed_batches_file.write(record)
-                self.error_records += len(self.record_batch)
-                self.pbar_sent.total = self.pbar_sent.total - len(self.record_batch)
-            self.record_batch = []
-        sleep(self.batch_delay)
+            self.failed_batches_file.write(
+                "".join(
+                    record["record"]
+                    for record in json.loads(batch_payload)["initialRecords"]
+                ).encode()
+            )
+            self.error_records += record_count
+            self.pbar_sent.total = self.pbar_sent.total - record_count
+        await asyncio.sleep(self.batch_delay)
+
+    async def submit_record_batch(self, counter, total_records) -> None:
+        """
+        Posts the current record batch in the background, waiting first if the maximum
+        number of batches are already in flight.
+
+        The payload is only built once the batch may be posted, so that its counter and
+        total account for the batches that have failed before it.
+
+        Args:
+            counter (int): The number of records read so far, including this batch.
+            total_records (int): The total number of records.
+        """
+        await self.batch_semaphore.acquire()
+        batch_payload = await self.create_batch_payload(counter, total_records, False)
+        record_count = len(self.record_batch)
+
+        async def post_and_release() -> None:
+            try:
+                await self.process_record_batch(batch_payload, record_count)
+            finally:
+                self.batch_semaphore.release()
+
+        task = asyncio.create_task(post_and_release())
+        self.pending_batches.add(task)
+        task.add_done_callback(self.pending_batches.discard)
 
     async def process_records(self, files, total_records) -> None:
         """
         Process records from the given files.
 
+        Record batches are posted in the background (see `submit_record_batch`), so the
+        next batch is read and prepared while the previous one is in flight. All pending
+        batches are awaited before the last batch is sent.
+
         Args:
             files (list): List of files to process.
             total_records (int): Total number of records to process.
@@ -328,83 +517,244 @@ class MARCImportJob:
             self.pbar_sent.set_description(
                 f"Sent ({os.path.basename(import_file.name)}): "
             )
-            reader = pymarc.MARCReader(import_file, hide_utf8_warnings=True)
-            for record in reader:
+            if self.preprocessor_func:
+                records = self.read_preprocessed_marc_records(import_file)
+            else:
+                records = self.read_raw_marc_records(import_file)
+            async for marc_record, chunk in records:
                 if len(self.record_batch) == self.batch_size:
-                    await self.process_record_batch(
-                        await self.create_batch_payload(counter, total_records, False),
-                    )
+                    await self.submit_record_batch(counter, total_records)
+                    self.record_batch.clear()
                     await self.get_job_status()
-                    sleep(0.25)
-                if record:
-                    if self.marc_record_preprocessor:
-                        record = await self.apply_marc_record_preprocessing(
-                            record, self.marc_record_preprocessor
-                        )
-                    self.record_batch.append(record.as_marc())
+                    await asyncio.sleep(0.25)
+                if marc_record is not None:
+                    self.record_batch.append(dump_json({"record": marc_record}))
                     counter += 1
                 else:
-                    self.bad_records_file.write(reader.current_chunk)
-            if self.record_batch:
-                await self.process_record_batch(
-                    await self.create_batch_payload(counter, total_records, True),
-                )
+                    self.bad_records_file.write(chunk)
+        if self.pending_batches:
+            await asyncio.gather(*self.pending_batches)
+        if self.record_batch:
+            await self.process_record_batch(
+                await self.create_batch_payload(counter, total_records, True),
+                len(self.record_batch),
+            )
+            self.record_batch.clear()
+
+    async def read_preprocessed_marc_records(
+        self, import_file
+    ) -> AsyncIterator[Tuple[Optional[str], bytes]]:
+        """
+        Reads MARC records from a file with pymarc and applies the configured preprocessor.
+
+        Records are parsed, preprocessed and serialized a batch at a time on a worker
+        thread, so the event loop can keep posting batches to FOLIO in the meantime.
+
+        Args:
+            import_file (io.BufferedReader): The MARC file to read.
+
+        Yields:
+            tuple: The preprocessed record as a MARC21 string (None if the record could not
+                be read) and the raw chunk read from the file.
+        """
+        reader = pymarc.MARCReader(import_file, hide_utf8_warnings=True)
+        while True:
+            records = await asyncio.to_thread(
+                self.preprocess_marc_records, reader, self.batch_size
+            )
+            if not records:
+                break
+            for record in records:
+                yield record
+
+    def preprocess_marc_records(
+        self, reader: pymarc.MARCReader, count: int
+    ) -> List[Tuple[Optional[str], bytes]]:
+        """
+        Reads up to `count` records from a MARCReader and applies the configured preprocessor.
+
+        Args:
+            reader (pymarc.MARCReader): The reader to take records from.
+            count (int): The maximum number of records to read.
+
+        Returns:
+            list: Tuples of the preprocessed record as a MARC21 string (None if the record
+                could not be read) and the raw chunk read from the file.
+        """
+        records = []
+        for record in itertools.islice(reader, count):
+            if record:
+                record = self.preprocess_marc_record(record, self.preprocessor_func)
+                records.append((record.as_marc().decode(), reader.current_chunk))
+            else:
+                records.append((None, reader.current_chunk))
+        return records
 
     @staticmethod
-    async def apply_marc_record_preprocessing(record: pymarc.Record, func_or_path) -> pymarc.Record:
+    async def read_raw_marc_records(
+        import_file,
+    ) -> AsyncIterator[Tuple[Optional[str], bytes]]:
         """
-        Apply preprocessing to the MARC record before sending it to FOLIO.
+        Reads MARC records from a file without building pymarc.Record objects.
+
+        The file is memory-mapped and records are sliced out of it using the record length
+        in each leader. Records already encoded as UTF-8 (leader/09 = "a") are sent exactly
+        as they appear in the file. Any other record is parsed by pymarc as MARC-8, converted
+        to Unicode and re-serialized as UTF-8 with leader/09 set to "a", just as the
+        preprocessing reader does. Bytes that are not valid MARC-8 (eg. a Latin-1 record with
+        a blank leader/09) are converted as pymarc maps them rather than rejected. Records
+        that pymarc cannot parse, and records flagged as UTF-8 that do not decode, end up in
+        the bad records file.
+
+        Args:
+            import_file (io.BufferedReader): The MARC file to read.
+
+        Yields:
+            tuple: The record as a MARC21 string (None if the record is invalid) and the raw
+                chunk read from the file.
+        """
+        try:
+            marc_data = mmap.mmap(import_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Empty files and in-memory streams cannot be memory-mapped
+            marc_data = import_file.read()
+        try:
+            position = 0
+            while position < len(marc_data):
+                chunk = marc_data[position:position + 5]
+                if len(chunk) < 5 or not chunk.isdigit() or int(chunk) < 24:
+                    position += len(chunk)
+                    yield None, chunk
+                    continue
+                length = int(chunk)
+                chunk = marc_data[position:position + length]
+                position += len(chunk)
+                if len(chunk) < length or chunk[-1:] != b"\x1d":
+                    yield None, chunk
+                    continue
+                marc_record = None
+                if chunk[9:10] == b"a":
+                    try:
+                        marc_record = chunk.decode("utf-8")
+                    except UnicodeDecodeError:
+                        marc_record = None
+                if marc_record is None:
+                    try:
+                        marc_record = pymarc.Record(
+                            chunk, hide_utf8_warnings=True
+                        ).as_marc().decode()
+                    except Exception:
+                        marc_record = None
+                yield marc_record, chunk
+        finally:
+            if isinstance(marc_data, mmap.mmap):
+                marc_data.close()
+
+    @staticmethod
+    def load_marc_record_preprocessor(func_or_path) -> Optional[Callable]:
+        """
+        Resolves a MARC record preprocessing function.
 
         Args:
-            record (pymarc.Record): The MARC record to preprocess.
             func_or_path (Union[Callable, str]): The preprocessing function or its import path.
 
         Returns:
-            pymarc.Record: The preprocessed MARC record.
+            Callable: The preprocessing function, or None if it could not be loaded.
         """
         if isinstance(func_or_path, str):
             try:
                 path_parts = func_or_path.rsplit('.')
                 module_path, func_name = ".".join(path_parts[:-1]), path_parts[-1]
                 module = importlib.import_module(module_path)
-                func = getattr(module, func_name)
+                return getattr(module, func_name)
             except (ImportError, AttributeError) as e:
                 print(f"Error importing preprocessing function {func_or_path}: {e}. Skipping preprocessing.")
-                return record
+                return None
         elif callable(func_or_path):
-            func = func_or_path
+            return func_or_path
         else:
             print(f"Invalid preprocessing function: {func_or_path}. Skipping preprocessing.")
-            return record
+            return None
+
+    @staticmethod
+    def preprocess_marc_record(record: pymarc.Record, func: Callable) -> pymarc.Record:
+        """
+        Applies a loaded preprocessing function to a MARC record.
+
+        Args:
+            record (pymarc.Record): The MARC record to preprocess.
+            func (Callable): The preprocessing function.
 
+        Returns:
+            pymarc.Record: The preprocessed MARC record, or the original record if preprocessing fails.
+        """
         try:
             return func(record)
         except Exception as e:
             print(f"Error applying preprocessing function: {e}. Skipping preprocessing.")
             return record
 
-    async def create_batch_payload(self, counter, total_records, is_last) -> dict:
+    @staticmethod
+    async def apply_marc_record_preprocessing(record: pymarc.Record, func_or_path) -> pymarc.Record:
+        """
+        Apply preprocessing to the MARC record before sending it to FOLIO.
+
+        Deprecated: kept for compatibility and no longer used by MARCImportJob. Use
+        `load_marc_record_preprocessor` once and `preprocess_marc_record` for each record.
+
+        Args:
+            record (pymarc.Record): The MARC record to preprocess.
+            func_or_path (Union[Callable, str]): The preprocessing function or its import path.
+
+        Returns:
+            pymarc.Record: The preprocessed MARC record.
+        """
+        warnings.warn(
+            "apply_marc_record_preprocessing is deprecated; use load_marc_record_preprocessor "
+            "and preprocess_marc_record instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        func = MARCImportJob.load_marc_record_preprocessor(func_or_path)
+        if func is None:
+            return record
+        return MARCImportJob.preprocess_marc_record(record, func)
+
+    async def create_batch_payload(self, counter, total_records, is_last) -> bytes:
         """
         Create a batch payload for data import.
 
+        The records in `record_batch` are already JSON-encoded, so the payload is assembled
+        by joining them rather than re-serializing every record for each batch.
+
         Args:
             counter (int): The current counter value.
             total_records (int): The total number of records.
             is_last (bool): Indicates if this is the last batch.
 
         Returns:
-            dict: The batch payload containing the ID, records metadata, and initial records.
+            bytes: The JSON batch payload containing the ID, records metadata, and initial
+                records.
         """
-        return {
-            "id": str(uuid.uuid4()),
-            "recordsMetadata": {
+        records_metadata = dump_json(
+            {
                 "last": is_last,
                 "counter": counter - self.error_records,
                 "contentType": "MARC_RAW",
                 "total": total_records - self.error_records,
-            },
-            "initialRecords": [{"record": x.decode()} for x in self.record_batch],
-        }
+            }
+        )
+        return b"".join(
+            (
+                b'{"id":"',
+                str(uuid.uuid4()).encode(),
+                b'","recordsMetadata":',
+                records_metadata,
+                b',"initialRecords":[',
+                b",".join(self.record_batch),
+                b"]}",
+            )
+        )
 
     async def import_marc_file(self) -> None:
         """
@@ -448,30 +798,32 @@ class MARCImportJob:
                 await self.process_records(files, total_records)
                 while not self.finished:
                     await self.get_job_status()
-                sleep(1)
+                    if not self.finished:
+                        await asyncio.sleep(JOB_STATUS_POLL_INTERVAL)
+                await asyncio.sleep(1)
             if self.finished:
+                # Imported here so that tabulate is only loaded once a report is printed
+                import tabulate
+
                 job_summary = await self.get_job_summary()
                 job_summary.pop("jobExecutionId")
                 job_summary.pop("totalErrors")
-                columns = ["Summary"] + list(job_summary.keys())
-                rows = set()
-                for key in columns[1:]:
-                    rows.update(job_summary[key].keys())
-
-                table_data = []
-                for row in rows:
-                    metric_name = decamelize(row).split("_")[1]
-                    table_row = [metric_name]
-                    for col in columns[1:]:
-                        table_row.append(job_summary[col].get(row, "N/A"))
-                    table_data.append(table_row)
+                column_values = list(job_summary.values())
+                rows = set().union(*column_values)
+
+                table_data = [
+                    [decamelize(row).split("_")[1]]
+                    + [values.get(row, "N/A") for values in column_values]
+                    for row in rows
+                ]
                 table_data.sort(key=lambda x: REPORT_SUMMARY_ORDERING.get(x[0], 99))
-                columns = columns[:1] + [
-                    " ".join(decamelize(x).split("_")[:-1]) for x in columns[1:]
+                columns = ["Summary"] + [
+                    " ".join(decamelize(x).split("_")[:-1]) for x in job_summary
                 ]
+                file_names = ", ".join(os.path.basename(x.name) for x in self.current_file)
                 print(
                     f"Results for {'file' if len(self.current_file) == 1 else 'files'}: "
-                    f"{', '.join([os.path.basename(x.name) for x in self.current_file])}"
+                    f"{file_names}"
                 )
                 print(
                     tabulate.tabulate(
@@ -485,26 +837,97 @@ class MARCImportJob:
         """
         Retrieves the job summary for the current job execution.
 
+        Timeouts and gateway errors are retried up to RETRY_MAX_ATTEMPTS times, with the
+        request timeout increasing on each attempt.
+
         Returns:
             dict: The job summary for the current job execution.
+
+        Raises:
+            HTTPError: If the job summary cannot be retrieved after RETRY_MAX_ATTEMPTS attempts.
         """
-        try:
-            self.current_retry_timeout = (
-                self.current_retry_timeout * RETRY_TIMEOUT_RETRY_FACTOR
-            ) if self.current_retry_timeout else RETRY_TIMEOUT_START
-            job_summary = self.folio_client.folio_get(
-                f"/metadata-provider/jobSummary/{self.job_id}"
-            )
-            self.current_retry_timeout = None
-        except httpx.ReadTimeout:  #
-            sleep(.25)
-            with httpx.Client(
-                timeout=self.current_retry_timeout,
-                verify=self.folio_client.ssl_verify
-            ) as temp_client:
-                self.folio_client.httpx_client = temp_client
-                return await self.get_job_summary()
-        return job_summary
+        retry_timeout = None
+        for attempt in range(RETRY_MAX_ATTEMPTS):
+            try:
+                return await self.folio_get(
+                    f"/metadata-provider/jobSummary/{self.job_id}",
+                    timeout=retry_timeout or httpx.USE_CLIENT_DEFAULT,
+                )
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRY_STATUS_CODES:
+                    raise
+                if attempt == RETRY_MAX_ATTEMPTS - 1:
+                    raise
+            except httpx.TimeoutException:
+                if attempt == RETRY_MAX_ATTEMPTS - 1:
+                    raise
+            retry_timeout = min(
+                retry_timeout * RETRY_TIMEOUT_RETRY_FACTOR, RETRY_TIMEOUT_MAX
+            ) if retry_timeout else RETRY_TIMEOUT_START
+            await asyncio.sleep(.25)
+
+
+def get_job_profiles(folio_client) -> List[dict]:
+    """
+    Retrieves all data import job profiles.
+
+    Args:
+        folio_client (FolioClient): An instance of the FolioClient class.
+
+    Returns:
+        list: The job profiles.
+    """
+    return folio_client.folio_get(
+        "/data-import-profiles/jobProfiles",
+        "jobProfiles",
+        query_params={"limit": "1000"},
+    )
+
+
+def prompt_for_import_profile(folio_client, data_type) -> Tuple[str, List[dict]]:
+    """
+    Asks the user to select a data import job profile.
+
+    Args:
+        folio_client (FolioClient): An instance of the FolioClient class.
+        data_type (str): Only profiles whose data type contains this value are offered.
+
+    Returns:
+        tuple: The name of the selected profile and all of the job profiles retrieved.
+    """
+    # Imported here so that inquirer is only loaded when prompting for a profile
+    import inquirer
+
+    import_profiles = get_job_profiles(folio_client)
+    import_profile_names = [
+        profile["name"]
+        for profile in import_profiles
+        if data_type.lower() in profile["dataType"].lower()
+    ]
+    questions = [
+        inquirer.List(
+            "import_profile_name",
+            message="Select an import profile",
+            choices=import_profile_names,
+        )
+    ]
+    answers = inquirer.prompt(questions)
+    return answers["import_profile_name"], import_profiles
+
+
+def find_marc_files(marc_file_path) -> List[Path]:
+    """
+    Finds the files matching a MARC file path or glob, with the semantics of `glob.glob`.
+
+    "**" matches any number of directories, as it did with `Path.glob`.
+
+    Args:
+        marc_file_path (str): A file path or glob, absolute or relative to the working directory.
+
+    Returns:
+        list: The matching files as Path objects.
+    """
+    return [Path(x) for x in glob.glob(marc_file_path, recursive=True)]
 
 
 async def main() -> None:
@@ -548,6 +971,15 @@ async def main() -> None:
         help="The number of seconds to wait between record batches.",
         default=0.0,
     )
+    parser.add_argument(
+        "--max_in_flight_batches",
+        type=int,
+        help=(
+            "The number of record batches that may be posted to FOLIO at the same time. "
+            "Values above 1 may deliver batches out of order."
+        ),
+        default=1,
+    )
     parser.add_argument(
         "--preprocessor",
         type=str,
@@ -581,10 +1013,7 @@ async def main() -> None:
     if args.member_tenant_id:
         folio_client.okapi_headers["x-okapi-tenant"] = args.member_tenant_id
 
-    if os.path.isabs(args.marc_file_path):
-        marc_files = [Path(x) for x in glob.glob(args.marc_file_path)]
-    else:
-        marc_files = list(Path("./").glob(args.marc_file_path))
+    marc_files = find_marc_files(args.marc_file_path)
 
     if len(marc_files) == 0:
         print(f"No files found matching {args.marc_file_path}. Exiting.")
@@ -592,26 +1021,11 @@ async def main() -> None:
     else:
         print(marc_files)
 
+    import_profiles = None
     if not args.import_profile_name:
-        import_profiles = folio_client.folio_get(
-            "/data-import-profiles/jobProfiles",
-            "jobProfiles",
-            query_params={"limit": "1000"},
+        args.import_profile_name, import_profiles = prompt_for_import_profile(
+            folio_client, "marc"
         )
-        import_profile_names = [
-            profile["name"]
-            for profile in import_profiles
-            if "marc" in profile["dataType"].lower()
-        ]
-        questions = [
-            inquirer.List(
-                "import_profile_name",
-                message="Select an import profile",
-                choices=import_profile_names,
-            )
-        ]
-        answers = inquirer.prompt(questions)
-        args.import_profile_name = answers["import_profile_name"]
     try:
         await MARCImportJob(
             folio_client,
@@ -619,6 +1033,8 @@ async def main() -> None:
             args.import_profile_name,
             batch_size=args.batch_size,
             batch_delay=args.batch_delay,
+            max_in_flight_batches=args.max_in_flight_batches,
+            job_profiles=import_profiles,
             marc_record_preprocessor=args.preprocessor,
             consolidate=bool(args.consolidate),
             no_progress=bool(args.no_progress),
@@ -632,8 +1048,8 @@ def sync_main() -> None:
     """
     Synchronous main function to run the MARC import job.
     """
-    asyncio.run(main())
+    run(main)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    sync_main()
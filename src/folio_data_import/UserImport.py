@@ -1,19 +1,21 @@
 import argparse
 import asyncio
+import copy
 import datetime
 import getpass
-import json
 import os
 import time
 from datetime import datetime as dt
 from pathlib import Path
-from typing import Tuple
+from typing import Tuple, Union
 
 import aiofiles
 import folioclient
 import httpx
 from aiofiles.threadpool.text import AsyncTextIOWrapper
 
+from folio_data_import._compat import cql_quote, dump_json, load_json, run
+
 try:
     utc = datetime.UTC
 except AttributeError:
@@ -30,6 +32,9 @@ PREFERRED_CONTACT_TYPES_MAP = {
     "005": "mobile",
 }
 
+# Maximum number of match values sent in a single existing-user lookup query
+USER_LOOKUP_CHUNK_SIZE = 50
+
 class UserImporter:  # noqa: R0902
     """
     Class to import mod-user-import compatible user objects
@@ -99,9 +104,11 @@ class UserImporter:  # noqa: R0902
         Main method to import users.
 
         This method triggers the process of importing users by calling the `process_file` method.
+        The file is read in binary mode, so each line is handed to the JSON parser as UTF-8
+        bytes without first being decoded to a str.
         """
         if self.user_file_path:
-            with open(self.user_file_path, "r", encoding="utf-8") as openfile:
+            with open(self.user_file_path, "rb") as openfile:
                 await self.process_file(openfile)
         else:
             raise FileNotFoundError("No user objects file provided")
@@ -130,6 +137,80 @@ class UserImporter:  # noqa: R0902
             existing_user = {}
         return existing_user
 
+    async def get_existing_users(self, user_objs) -> dict:
+        """
+        Retrieves the existing users for a batch of user objects, using one query for every
+        USER_LOOKUP_CHUNK_SIZE users instead of one query per user.
+
+        Args:
+            user_objs (list): The user objects containing the information to match against
+                existing users.
+
+        Returns:
+            dict: The existing user object (or an empty dictionary if there is none) for each
+                (match key, match value) pair that could be resolved. Users that are missing
+                from the result should be looked up individually with get_existing_user.
+        """
+        match_values = {}
+        for user_obj in user_objs:
+            match_key = "id" if ("id" in user_obj) else self.match_key
+            if match_key in user_obj:
+                match_values.setdefault(match_key, set()).add(str(user_obj[match_key]))
+        lookups = []
+        for match_key, values in match_values.items():
+            values = sorted(values)
+            for i in range(0, len(values), USER_LOOKUP_CHUNK_SIZE):
+                lookups.append(
+                    self.get_existing_users_by_match_key(
+                        match_key, values[i:i + USER_LOOKUP_CHUNK_SIZE]
+                    )
+                )
+        existing_users = {}
+        for found_users in await asyncio.gather(*lookups):
+            existing_users.update(found_users)
+        return existing_users
+
+    async def get_existing_users_by_match_key(self, match_key, match_values) -> dict:
+        """
+        Retrieves the existing users whose match key equals one of the given values.
+
+        Args:
+            match_key (str): The user field to match on.
+            match_values (list): The values to match.
+
+        Returns:
+            dict: The existing user object (or an empty dictionary if there is none) for each
+                resolved (match key, match value) pair. If FOLIO returns users that do not
+                match a value exactly (e.g. a case-insensitive match), or more users than were
+                requested, values without an exact match are left out of the result.
+        """
+        query_values = " or ".join(cql_quote(value) for value in match_values)
+        try:
+            async with self.limit_simultaneous_requests:
+                response = await self.http_client.get(
+                    self.folio_client.okapi_url + "/users",
+                    headers=self.folio_client.okapi_headers,
+                    params={
+                        "query": f"{match_key}==({query_values})",
+                        "limit": len(match_values),
+                    },
+                )
+            response.raise_for_status()
+            response_json = response.json()
+        except httpx.HTTPError:
+            return {}
+        users = response_json.get("users", [])
+        found_users = {}
+        for user in users:
+            if str(user.get(match_key)) in match_values:
+                found_users.setdefault((match_key, str(user[match_key])), user)
+        if len(found_users) == len(users) and response_json.get(
+            "totalRecords", len(users)
+        ) <= len(users):
+            for value in match_values:
+                found_users.setdefault((match_key, value), {})
+        return found_users
+
     async def get_existing_rp(self, user_obj, existing_user) -> dict:
         """
         Retrieves the existing request preferences for a given user.
@@ -322,13 +403,37 @@ class UserImporter:  # noqa: R0902
                     existing_user[key] = value
             else:
                 existing_user[key] = value
-        create_update_user = await self.http_client.put(
-            self.folio_client.okapi_url + f"/users/{existing_user['id']}",
-            headers=self.folio_client.okapi_headers,
-            json=existing_user,
+        create_update_user = await self.send_json(
+            "PUT",
+            f"/users/{existing_user['id']}",
+            existing_user,
         )
         return existing_user, create_update_user
 
+    async def send_json(self, method, path, obj) -> httpx.Response:
+        """
+        Sends an object to a FOLIO API as a JSON request body.
+
+        The body is serialized with orjson when it is installed (see dump_json), rather than
+        by httpx with the standard json module.
+
+        Args:
+            method (str): The HTTP method, e.g. "POST" or "PUT".
+            path (str): The API path to send the object to.
+            obj (dict): The object to send.
+
+        Returns:
+            httpx.Response: The response from FOLIO.
+        """
+        headers = httpx.Headers(self.folio_client.okapi_headers)
+        headers["content-type"] = "application/json"
+        return await self.http_client.request(
+            method,
+            self.folio_client.okapi_url + path,
+            headers=headers,
+            content=dump_json(obj),
+        )
+
     async def create_new_user(self, user_obj) -> dict:
         """
         Creates a new user in the system.
@@ -342,11 +447,7 @@ class UserImporter:  # noqa: R0902
         Raises:
             HTTPError: If the HTTP request to create the user fails.
         """
-        response = await self.http_client.post(
-            self.folio_client.okapi_url + "/users",
-            headers=self.folio_client.okapi_headers,
-            json=user_obj,
-        )
+        response = await self.send_json("POST", "/users", user_obj)
         response.raise_for_status()
         async with self.lock:
             self.logs["created"] += 1
@@ -416,7 +517,7 @@ class UserImporter:  # noqa: R0902
                     f"{str(getattr(getattr(ee, 'response', str(ee)), 'text', str(ee)))}\n"
                 )
                 await self.errorfile.write(
-                    json.dumps(existing_user, ensure_ascii=False) + "\n"
+                    dump_json(existing_user).decode() + "\n"
                 )
                 self.logs["failed"] += 1
                 return {}
@@ -434,23 +535,23 @@ class UserImporter:  # noqa: R0902
                     f"{str(getattr(getattr(ee, 'response', str(ee)), 'text', str(ee)))}\n"
                 )
                 await self.errorfile.write(
-                    json.dumps(user_obj, ensure_ascii=False) + "\n"
+                    dump_json(user_obj).decode() + "\n"
                 )
                 self.logs["failed"] += 1
                 return {}
 
-    async def process_user_obj(self, user: str) -> dict:
+    async def process_user_obj(self, user) -> dict:
         """
         Process a user object. If not type is found in the source object, type is set to "patron".
 
         Args:
-            user (str): The user data to be processed, as a json string.
+            user (str | bytes): The user data to be processed, as a json string.
 
         Returns:
             dict: The processed user object.
 
         """
-        user_obj = json.loads(user)
+        user_obj = load_json(user)
         user_obj["type"] = user_obj.get("type", "patron")
         return user_obj
 
@@ -480,12 +581,16 @@ class UserImporter:  # noqa: R0902
                     protected_fields.pop(field)
         return protected_fields
 
-    async def process_existing_user(self, user_obj) -> Tuple[dict, dict, dict, dict]:
+    async def process_existing_user(
+        self, user_obj, existing_users=None
+    ) -> Tuple[dict, dict, dict, dict]:
         """
         Process an existing user.
 
         Args:
             user_obj (dict): The user object to process.
+            existing_users (dict): Existing users already retrieved for the current batch
+                (see get_existing_users).
 
         Returns:
             tuple: A tuple containing the request preference object (rp_obj),
@@ -494,7 +599,14 @@ class UserImporter:  # noqa: R0902
         """
         rp_obj = user_obj.pop("requestPreference", {})
         spu_obj = user_obj.pop("servicePointsUser")
-        existing_user = await self.get_existing_user(user_obj)
+        match_key = "id" if ("id" in user_obj) else self.match_key
+        batch_match = (match_key, str(user_obj.get(match_key)))
+        if existing_users and batch_match in existing_users:
+            # Lines in a batch may share a match value, and the existing user is modified
+            # in place while it is updated, so each line gets its own copy
+            existing_user = copy.deepcopy(existing_users[batch_match])
+        else:
+            existing_user = await self.get_existing_user(user_obj)
         if existing_user:
             existing_rp = await self.get_existing_rp(user_obj, existing_user)
             existing_pu = await self.get_existing_pu(user_obj, existing_user)
@@ -542,11 +654,10 @@ class UserImporter:  # noqa: R0902
         rp_obj = {"holdShelf": True, "delivery": False}
         rp_obj["userId"] = new_user_obj["id"]
         # print(rp_obj)
-        response = await self.http_client.post(
-            self.folio_client.okapi_url
-            + "/request-preference-storage/request-preference",
-            headers=self.folio_client.okapi_headers,
-            json=rp_obj,
+        response = await self.send_json(
+            "POST",
+            "/request-preference-storage/request-preference",
+            rp_obj,
         )
         response.raise_for_status()
 
@@ -566,11 +677,10 @@ class UserImporter:  # noqa: R0902
         """
         existing_rp.update(rp_obj)
         # print(existing_rp)
-        response = await self.http_client.put(
-            self.folio_client.okapi_url
-            + f"/request-preference-storage/request-preference/{existing_rp['id']}",
-            headers=self.folio_client.okapi_headers,
-            json=existing_rp,
+        response = await self.send_json(
+            "PUT",
+            f"/request-preference-storage/request-preference/{existing_rp['id']}",
+            existing_rp,
         )
         response.raise_for_status()
 
@@ -588,24 +698,24 @@ class UserImporter:  # noqa: R0902
             None
         """
         perms_user_obj = {"userId": new_user_obj["id"], "permissions": []}
-        response = await self.http_client.post(
-            self.folio_client.okapi_url + "/perms/users",
-            headers=self.folio_client.okapi_headers,
-            json=perms_user_obj,
-        )
+        response = await self.send_json("POST", "/perms/users", perms_user_obj)
         response.raise_for_status()
 
     async def process_line(
         self,
-        user: str,
+        user: Union[str, bytes, dict],
         line_number: int,
+        existing_users: dict = None,
     ) -> None:
         """
         Process a single line of user data.
 
         Args:
-            user (str): The user data to be processed.
-            logs (dict): A dictionary to store logs.
+            user (str | bytes | dict): The user data to be processed, as a json string or
+                as a user object already parsed with process_user_obj.
+            line_number (int): The line number of the user object in the file.
+            existing_users (dict): Existing users already retrieved for the current batch
+                (see get_existing_users).
 
         Returns:
             None
@@ -614,10 +724,13 @@ class UserImporter:  # noqa: R0902
             Any exceptions that occur during the processing.
 
         """
-        async with self.limit_simultaneous_requests:
+        if isinstance(user, dict):
+            user_obj = user
+        else:
             user_obj = await self.process_user_obj(user)
+        async with self.limit_simultaneous_requests:
             rp_obj, spu_obj, existing_user, protected_fields, existing_rp, existing_pu, existing_spu = (
-                await self.process_existing_user(user_obj)
+                await self.process_existing_user(user_obj, existing_users)
             )
             await self.map_address_types(user_obj, line_number)
             await self.map_patron_groups(user_obj, line_number)
@@ -753,11 +866,7 @@ class UserImporter:  # noqa: R0902
             None
         """
         spu_obj["userId"] = existing_user["id"]
-        response = await self.http_client.post(
-            self.folio_client.okapi_url + "/service-points-users",
-            headers=self.folio_client.okapi_headers,
-            json=spu_obj,
-        )
+        response = await self.send_json("POST", "/service-points-users", spu_obj)
         response.raise_for_status()
 
     async def update_existing_spu(self, spu_obj, existing_spu):
@@ -772,10 +881,10 @@ class UserImporter:  # noqa: R0902
             None
         """
         existing_spu.update(spu_obj)
-        response = await self.http_client.put(
-            self.folio_client.okapi_url + f"/service-points-users/{existing_spu['id']}",
-            headers=self.folio_client.okapi_headers,
-            json=existing_spu,
+        response = await self.send_json(
+            "PUT",
+            f"/service-points-users/{existing_spu['id']}",
+            existing_spu,
         )
         response.raise_for_status()
 
@@ -784,38 +893,45 @@ class UserImporter:  # noqa: R0902
         Process the user object file.
 
         Args:
-            openfile: The file or file-like object to process.
+            openfile: The file or file-like object to process, in text or binary mode.
         """
-        tasks = []
+        batch = []
         for line_number, user in enumerate(openfile):
-            tasks.append(self.process_line(user, line_number))
-            if len(tasks) == self.batch_size:
-                start = time.time()
-                await asyncio.gather(*tasks)
-                duration = time.time() - start
-                async with self.lock:
-                    message = (
-                        f"{dt.now().isoformat(sep=' ', timespec='milliseconds')}: "
-                        f"Batch of {self.batch_size} users processed in {duration:.2f} "
-                        f"seconds. - Users created: {self.logs['created']} - Users updated: "
-                        f"{self.logs['updated']} - Users failed: {self.logs['failed']}"
-                    )
-                    print(message)
-                    await self.logfile.write(message + "\n")
-                tasks = []
-        if tasks:
-            start = time.time()
-            await asyncio.gather(*tasks)
-            duration = time.time() - start
-            async with self.lock:
-                message = (
-                    f"{dt.now().isoformat(sep=' ', timespec='milliseconds')}: "
-                    f"Batch of {len(tasks)} users processed in {duration:.2f} seconds. - "
-                    f"Users created: {self.logs['created']} - Users updated: "
-                    f"{self.logs['updated']} - Users failed: {self.logs['failed']}"
-                )
-                print(message)
-                await self.logfile.write(message + "\n")
+            batch.append((await self.process_user_obj(user), line_number))
+            if len(batch) == self.batch_size:
+                await self.process_batch(batch)
+                batch = []
+        if batch:
+            await self.process_batch(batch)
+
+    async def process_batch(self, batch) -> None:
+        """
+        Process a batch of user objects and log the running totals.
+
+        The existing users for the whole batch are retrieved up front (see
+        get_existing_users), then the user objects are processed concurrently.
+
+        Args:
+            batch (list): (user object, line number) tuples to process.
+        """
+        start = time.time()
+        existing_users = await self.get_existing_users([user_obj for user_obj, _ in batch])
+        await asyncio.gather(
+            *[
+                self.process_line(user_obj, line_number, existing_users)
+                for user_obj, line_number in batch
+            ]
+        )
+        duration = time.time() - start
+        async with self.lock:
+            message = (
+                f"{dt.now().isoformat(sep=' ', timespec='milliseconds')}: "
+                f"Batch of {len(batch)} users processed in {duration:.2f} seconds. - "
+                f"Users created: {self.logs['created']} - Users updated: "
+                f"{self.logs['updated']} - Users failed: {self.logs['failed']}"
+            )
+            print(message)
+            await self.logfile.write(message + "\n")
 
 
 async def main() -> None:
@@ -920,20 +1036,22 @@ async def main() -> None:
 
     user_file_path = Path(args.user_file_path)
     report_file_base_path = Path(args.report_file_base_path)
-    log_file_path = (
-        report_file_base_path
-        / f"log_user_import_{dt.now(utc).strftime('%Y%m%d_%H%M%S')}.log"
-    )
-    error_file_path = (
-        report_file_base_path
-        / f"failed_user_import_{dt.now(utc).strftime('%Y%m%d_%H%M%S')}.txt"
-    )
+    timestamp = dt.now(utc).strftime("%Y%m%d_%H%M%S")
+    log_file_path = report_file_base_path / f"log_user_import_{timestamp}.log"
+    error_file_path = report_file_base_path / f"failed_user_import_{timestamp}.txt"
     async with aiofiles.open(
         log_file_path,
         "w",
     ) as logfile, aiofiles.open(
         error_file_path, "w"
-    ) as errorfile, httpx.AsyncClient(timeout=None) as http_client:
+    ) as errorfile, httpx.AsyncClient(
+        timeout=None,
+        # One idle connection per concurrent request
+        limits=httpx.Limits(
+            max_keepalive_connections=args.limit_async_requests,
+            max_connections=max(100, args.limit_async_requests),
+        ),
+    ) as http_client:
         try:
             importer = UserImporter(
                 folio_client,
@@ -961,9 +1079,9 @@ def sync_main() -> None:
 
     This function is used to run the main function in a synchronous context.
     """
-    asyncio.run(main())
+    run(main)
 
 
 # Run the main function
 if __name__ == "__main__":
-    asyncio.run(main())
+    sync_main()
@@ -1,13 +1,14 @@
 import argparse
-import asyncio
-import glob
 from getpass import getpass
-from pathlib import Path
 
 import folioclient
-import inquirer
 
-from folio_data_import.MARCDataImport import MARCImportJob
+from folio_data_import._compat import run
+from folio_data_import.MARCDataImport import (
+    MARCImportJob,
+    find_marc_files,
+    prompt_for_import_profile,
+)
 
 
 async def main():
@@ -61,29 +62,14 @@ async def main():
     folio_client = folioclient.FolioClient(
         args.gateway_url, args.tenant_id, args.username, args.password
     )
+    import_profiles = None
     if not args.import_profile_name:
-        import_profiles = folio_client.folio_get(
-            "/data-import-profiles/jobProfiles",
-            "jobProfiles",
-            query_params={"limit": "1000"},
+        args.import_profile_name, import_profiles = prompt_for_import_profile(
+            folio_client, args.record_type
         )
-        import_profile_names = [
-            profile["name"]
-            for profile in import_profiles
-            if args.record_type.lower() in profile["dataType"].lower()
-        ]
-        questions = [
-            inquirer.List(
-                "import_profile_name",
-                message="Select an import profile",
-                choices=import_profile_names,
-            )
-        ]
-        answers = inquirer.prompt(questions)
-        args.import_profile_name = answers["import_profile_name"]
 
     if args.record_type.lower() == "marc21":
-        marc_files = [Path(x) for x in glob.glob(args.marc_file_path, root_dir="./")]
+        marc_files = find_marc_files(args.marc_file_path)
         print(marc_files)
         try:
             await MARCImportJob(
@@ -92,6 +78,7 @@ async def main():
                 args.import_profile_name,
                 batch_size=args.batch_size,
                 batch_delay=args.batch_delay,
+                job_profiles=import_profiles,
                 consolidate=bool(args.consolidate),
                 no_progress=bool(args.no_progress),
             ).do_work()
@@ -108,8 +95,8 @@ async def main():
 
 
 def sync_main():
-    asyncio.run(main())
+    run(main)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    sync_main()
@@ -0,0 +1,50 @@
+"""Helpers shared by the importers and their entry points, including optional-dependency fallbacks."""
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+try:
+    from orjson import dumps as dump_json
+    from orjson import loads as load_json
+except ImportError:
+    load_json = json.loads
+
+    def dump_json(obj) -> bytes:
+        """Serializes obj to UTF-8 encoded JSON (fallback when orjson is not installed)."""
+        return json.dumps(obj, ensure_ascii=False).encode()
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+def cql_quote(value: str) -> str:
+    r"""
+    Quotes a value for use as an exact-match term in a CQL query.
+
+    Backslashes, double quotes and the CQL masking characters (*, ? and ^) are escaped,
+    so the value is matched literally.
+
+    Args:
+        value (str): The value to quote.
+
+    Returns:
+        str: The value in double quotes, e.g. "Default \"MARC\" import".
+    """
+    return '"' + "".join("\\" + char if char in '\\"*?^' else char for char in value) + '"'
+
+
+def run(main: Callable[[], Awaitable[None]]) -> None:
+    """
+    Runs an async entry point to completion.
+
+    Uses a uvloop event loop when uvloop is installed (see the "performance" extra).
+
+    Args:
+        main (Callable): The async function to run.
+    """
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -0,0 +1,18 @@
+from unittest.mock import Mock
+
+import pytest
+
+
+class FakeFolioClient:
+    """Stand-in for FolioClient with only the attributes the importers use."""
+
+    def __init__(self):
+        self.okapi_url = "https://folio.example.com"
+        self.okapi_headers = {"x-okapi-tenant": "test_tenant"}
+        self.folio_get = Mock()
+        self.folio_get_all = Mock(return_value=[])
+
+
+@pytest.fixture
+def folio_client():
+    return FakeFolioClient()
@@ -1,16 +1,337 @@
+import asyncio
+import io
+import json
+from pathlib import Path
 from unittest.mock import Mock
-from folio_data_import.MARCDataImport import MARCImportJob
-from folioclient import FolioClient
+from folio_data_import.MARCDataImport import (
+    JOB_NOT_FOUND_MAX_POLLS,
+    REPORT_FILE_BUFFER_SIZE,
+    MARCImportJob,
+    find_marc_files,
+    prompt_for_import_profile,
+)
+import httpx
+import pymarc
 import pytest
 
 
-@pytest.fixture
-def folio_client():
-    folio_client = Mock(spec=FolioClient)
-    return folio_client
-
-
 @pytest.fixture
 def marc_import_job(folio_client):
     marc_import_job = Mock(spec=MARCImportJob)
     return marc_import_job
+
+
+def _sample_marc_record(title="Sample title"):
+    record = pymarc.Record()
+    record.add_field(pymarc.Field(tag="001", data="123"))
+    record.add_field(
+        pymarc.Field(
+            tag="245",
+            indicators=pymarc.Indicators("0", "0"),
+            subfields=[pymarc.Subfield(code="a", value=title)],
+        )
+    )
+    return record.as_marc()
+
+
+# Encoded once for the tests that only need some valid record bytes
+SAMPLE_MARC_RECORD = _sample_marc_record()
+
+
+async def _collect(async_iterator):
+    return [item async for item in async_iterator]
+
+
+def test_read_raw_marc_records():
+    good_record = _sample_marc_record("Café")
+    truncated_record = SAMPLE_MARC_RECORD[:-10]
+    import_file = io.BytesIO(good_record + good_record + truncated_record)
+
+    records = asyncio.run(
+        _collect(MARCImportJob.read_raw_marc_records(import_file))
+    )
+
+    assert records[0] == (good_record.decode("utf-8"), good_record)
+    assert records[1] == (good_record.decode("utf-8"), good_record)
+    assert records[2] == (None, truncated_record)
+    assert len(records) == 3
+
+
+def test_read_raw_marc_records_without_utf8_leader():
+    marc8_record = SAMPLE_MARC_RECORD[:9] + b" " + SAMPLE_MARC_RECORD[10:]
+    marc8_diacritics_record = marc8_record.replace(b"Sample title", b"Caf\xe2e titles")
+    import_file = io.BytesIO(marc8_record + marc8_diacritics_record)
+
+    records = asyncio.run(_collect(MARCImportJob.read_raw_marc_records(import_file)))
+
+    assert records[0][0].endswith("\x1faSample title\x1e\x1d")
+    assert records[0][0][9] == "a"
+    assert records[1][0].endswith("\x1faCafé titles\x1e\x1d")
+    assert records[1][0][9] == "a"
+    assert records[1][1] == marc8_diacritics_record
+
+
+def test_read_total_records(folio_client, tmp_path):
+    marc_file = tmp_path / "records.mrc"
+    marc_file.write_bytes(SAMPLE_MARC_RECORD * 3)
+    empty_file = tmp_path / "empty.mrc"
+    empty_file.touch()
+
+    with open(marc_file, "rb") as mapped, open(empty_file, "rb") as empty:
+        in_memory = io.BytesIO(SAMPLE_MARC_RECORD * 2)
+        import_job = MARCImportJob(folio_client, [], "profile")
+        total = asyncio.run(import_job.read_total_records([mapped, empty, in_memory]))
+
+    assert total == 5
+    assert in_memory.tell() == 0
+
+
+def test_get_job_status_uses_job_execution_endpoint(folio_client):
+    responses = iter(
+        [
+            {"id": "job-1", "status": "PARSING_IN_PROGRESS", "progress": {"current": 4}},
+            {"id": "job-1", "status": "COMMITTED", "progress": {"current": 10}},
+        ]
+    )
+    requested_paths = []
+
+    def handler(request):
+        requested_paths.append(request.url.path)
+        return httpx.Response(200, json=next(responses))
+
+    job = MARCImportJob(folio_client, [], "profile")
+    job.job_id = "job-1"
+    job.pbar_imported = Mock()
+
+    async def poll_twice():
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(handler)
+        ) as job.http_client:
+            await job.get_job_status()
+            assert not job.finished
+            await job.get_job_status()
+
+    asyncio.run(poll_twice())
+
+    assert job.finished
+    assert job.last_current == 10
+    assert requested_paths == ["/change-manager/jobExecutions/job-1"] * 2
+
+
+def test_get_job_status_gives_up_on_missing_job(folio_client):
+    job = MARCImportJob(folio_client, [], "profile")
+    job.job_id = "job-1"
+
+    async def poll_until_error():
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(404))
+        ) as job.http_client:
+            for _ in range(JOB_NOT_FOUND_MAX_POLLS - 1):
+                await job.get_job_status()
+            with pytest.raises(httpx.HTTPStatusError):
+                await job.get_job_status()
+
+    asyncio.run(poll_until_error())
+
+
+def test_wrap_up_removes_only_empty_report_files(folio_client, tmp_path):
+    job = MARCImportJob(folio_client, [], "profile")
+    # Opened the way do_work opens them, so the write below is still unflushed
+    with open(
+        tmp_path / "bad_marc_records.mrc", "wb+", buffering=REPORT_FILE_BUFFER_SIZE
+    ) as bad_records, open(
+        tmp_path / "failed_batches.mrc", "wb+", buffering=REPORT_FILE_BUFFER_SIZE
+    ) as failed_batches:
+        failed_batches.write(SAMPLE_MARC_RECORD)
+        job.bad_records_file = bad_records
+        job.failed_batches_file = failed_batches
+        asyncio.run(job.wrap_up())
+
+    assert not (tmp_path / "bad_marc_records.mrc").exists()
+    assert (tmp_path / "failed_batches.mrc").exists()
+
+
+def test_read_raw_marc_records_from_mapped_file(tmp_path):
+    first_record = _sample_marc_record("First")
+    second_record = _sample_marc_record("Second")
+    marc_file = tmp_path / "records.mrc"
+    marc_file.write_bytes(first_record + second_record)
+    empty_file = tmp_path / "empty.mrc"
+    empty_file.touch()
+
+    with open(marc_file, "rb") as import_file:
+        records = asyncio.run(
+            _collect(MARCImportJob.read_raw_marc_records(import_file))
+        )
+    with open(empty_file, "rb") as import_file:
+        empty_records = asyncio.run(
+            _collect(MARCImportJob.read_raw_marc_records(import_file))
+        )
+
+    assert records == [
+        (first_record.decode("utf-8"), first_record),
+        (second_record.decode("utf-8"), second_record),
+    ]
+    assert empty_records == []
+
+
+def test_create_batch_payload(folio_client):
+    import_job = MARCImportJob(folio_client, [], "Test profile")
+    import_job.error_records = 1
+    marc_records = ['00024 "quoted" \\ Café\x1e\x1d', "second\x1d"]
+    import_job.record_batch = [
+        json.dumps({"record": marc_record}).encode() for marc_record in marc_records
+    ]
+
+    payload = json.loads(
+        asyncio.run(import_job.create_batch_payload(10, 20, True))
+    )
+
+    assert payload["recordsMetadata"] == {
+        "last": True,
+        "counter": 9,
+        "contentType": "MARC_RAW",
+        "total": 19,
+    }
+    assert payload["initialRecords"] == [
+        {"record": marc_record} for marc_record in marc_records
+    ]
+
+
+def test_submit_record_batch_counts_earlier_failed_batches(folio_client):
+    posted = []
+
+    async def handler(request):
+        posted.append(json.loads(request.content))
+        return httpx.Response(500 if len(posted) == 1 else 201)
+
+    async def submit_batches():
+        import_job = MARCImportJob(folio_client, [], "Test profile")
+        import_job.records_url = "https://folio.example.com/records"
+        import_job.batch_semaphore = asyncio.Semaphore(1)
+        import_job.pending_batches = set()
+        import_job.pbar_sent = Mock(total=4)
+        import_job.failed_batches_file = io.BytesIO()
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(handler)
+        ) as http_client:
+            import_job.http_client = http_client
+            for counter in (2, 4):
+                import_job.record_batch = [b'{"record":"a"}', b'{"record":"b"}']
+                await import_job.submit_record_batch(counter, 4)
+            await asyncio.gather(*import_job.pending_batches)
+        return import_job
+
+    import_job = asyncio.run(submit_batches())
+
+    assert import_job.error_records == 2
+    assert [payload["recordsMetadata"]["counter"] for payload in posted] == [2, 2]
+    assert [payload["recordsMetadata"]["total"] for payload in posted] == [4, 2]
+
+
+def test_get_import_profile_queries_by_name(folio_client):
+    profile = {"id": "profile-id", "name": 'Default "MARC" import'}
+    folio_client.folio_get.return_value = [profile]
+    import_job = MARCImportJob(folio_client, [], profile["name"])
+
+    asyncio.run(import_job.get_import_profile())
+    asyncio.run(import_job.get_import_profile())
+
+    folio_client.folio_get.assert_called_once_with(
+        "/data-import-profiles/jobProfiles",
+        "jobProfiles",
+        query_params={"query": 'name=="Default \\"MARC\\" import"', "limit": "10"},
+    )
+    assert import_job.job_profile_payload == {
+        "id": "profile-id",
+        "name": 'Default "MARC" import',
+        "dataType": "MARC",
+    }
+
+
+def test_get_job_summary_retries_gateway_errors(folio_client, monkeypatch):
+    responses = [httpx.Response(504), httpx.Response(200, json={"jobExecutionId": "job-id"})]
+
+    async def no_sleep(delay):
+        pass
+
+    async def get_summary():
+        import_job = MARCImportJob(folio_client, [], "Test profile")
+        import_job.job_id = "job-id"
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: responses.pop(0))
+        ) as http_client:
+            import_job.http_client = http_client
+            return await import_job.get_job_summary()
+
+    monkeypatch.setattr(asyncio, "sleep", no_sleep)
+    assert asyncio.run(get_summary()) == {"jobExecutionId": "job-id"}
+    assert responses == []
+
+
+def test_find_marc_files(tmp_path, monkeypatch):
+    for file_name in ("b.mrc", "a.mrc", "notes.txt", ".hidden.mrc"):
+        (tmp_path / file_name).touch()
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "c.mrc").touch()
+    monkeypatch.chdir(tmp_path)
+
+    assert sorted(find_marc_files("*.mrc")) == [Path("a.mrc"), Path("b.mrc")]
+    assert sorted(find_marc_files(str(tmp_path / "*.mrc"))) == [
+        tmp_path / "a.mrc",
+        tmp_path / "b.mrc",
+    ]
+    assert find_marc_files("s*/*.mrc") == [Path("sub/c.mrc")]
+    assert sorted(find_marc_files("**/*.mrc")) == [
+        Path("a.mrc"),
+        Path("b.mrc"),
+        Path("sub/c.mrc"),
+    ]
+    assert find_marc_files("notes.txt") == [Path("notes.txt")]
+    assert find_marc_files("missing/*.mrc") == []
+
+
+def test_get_import_profile_uses_provided_job_profiles(folio_client):
+    profile = {"id": "profile-id", "name": "Default MARC import"}
+    import_job = MARCImportJob(
+        folio_client, [], profile["name"], job_profiles=[profile]
+    )
+    asyncio.run(import_job.get_import_profile())
+
+    folio_client.folio_get.assert_not_called()
+    assert import_job.job_import_profile == profile
+
+
+def test_get_import_profile_lists_profiles_missing_from_provided_ones(folio_client):
+    profile = {"id": "new-profile-id", "name": "New MARC import"}
+    folio_client.folio_get.side_effect = [[], [profile]]
+    import_job = MARCImportJob(
+        folio_client,
+        [],
+        profile["name"],
+        job_profiles=[{"id": "profile-id", "name": "Default MARC import"}],
+    )
+    asyncio.run(import_job.get_import_profile())
+
+    assert folio_client.folio_get.call_count == 2
+    assert import_job.job_import_profile == profile
+
+
+def test_prompt_for_import_profile_offers_matching_profiles(folio_client, monkeypatch):
+    import inquirer
+
+    profiles = [
+        {"id": "1", "name": "MARC import", "dataType": "MARC"},
+        {"id": "2", "name": "EDIFACT import", "dataType": "EDIFACT"},
+    ]
+    folio_client.folio_get.return_value = profiles
+    prompted_choices = []
+
+    def prompt(questions):
+        prompted_choices.extend(questions[0].choices)
+        return {"import_profile_name": "MARC import"}
+
+    monkeypatch.setattr(inquirer, "prompt", prompt)
+
+    assert prompt_for_import_profile(folio_client, "marc") == ("MARC import", profiles)
+    assert prompted_choices == ["MARC import"]
@@ -1,17 +1,11 @@
-from unittest.mock import Mock
+import asyncio
+import json
 
-import pytest
-from folioclient import FolioClient
+import httpx
 
 from folio_data_import.UserImport import UserImporter
 
 
-@pytest.fixture
-def folio_client():
-    folio_client = Mock(spec=FolioClient)
-    return folio_client
-
-
 def test_build_ref_data_id_map(folio_client):
     # Mock the response from folio_get_all method
     def mock_folio_get_all(endpoint, key):
@@ -71,3 +65,103 @@ def test_build_ref_data_id_map(folio_client):
         "ServicePoint2": "200",
         "ServicePoint3": "300",
     }
+
+
+def test_get_existing_users(folio_client):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        users = []
+        if "ext-1" in request.url.params["query"]:
+            users = [{"id": "user-1", "externalSystemId": "ext-1"}]
+        return httpx.Response(200, json={"users": users, "totalRecords": len(users)})
+
+    async def get_existing_users():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            importer = UserImporter(
+                folio_client, "Test library", 10, asyncio.Semaphore(1), None, None, client
+            )
+            return await importer.get_existing_users(
+                [
+                    {"externalSystemId": "ext-1"},
+                    {"externalSystemId": 'ext-"2"'},
+                    {"id": "user-3", "externalSystemId": "ext-3"},
+                ]
+            )
+
+    existing_users = asyncio.run(get_existing_users())
+
+    assert existing_users == {
+        ("externalSystemId", "ext-1"): {"id": "user-1", "externalSystemId": "ext-1"},
+        ("externalSystemId", 'ext-"2"'): {},
+        ("id", "user-3"): {},
+    }
+    assert sorted(request.url.params["query"] for request in requests) == [
+        'externalSystemId==("ext-\\"2\\"" or "ext-1")',
+        'id==("user-3")',
+    ]
+
+
+def test_process_batch_copies_existing_user_shared_by_lines(folio_client):
+    existing_user = {
+        "id": "user-1",
+        "externalSystemId": "ext-1",
+        "personal": {"lastName": "Existing", "preferredContactTypeId": "002"},
+    }
+    updated_users = []
+
+    class LogFile:
+        async def write(self, text):
+            pass
+
+    def handler(request):
+        if request.method == "PUT" and request.url.path == "/users/user-1":
+            updated_users.append(json.loads(request.content))
+            return httpx.Response(204)
+        if request.method == "GET":
+            return httpx.Response(200, json={"totalRecords": 0})
+        return httpx.Response(201, json=json.loads(request.content or b"{}"))
+
+    folio_client.folio_get_all.side_effect = lambda endpoint, key: (
+        [{"id": "group-1", "group": "staff"}] if endpoint == "/groups" else []
+    )
+
+    async def process_batch():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            importer = UserImporter(
+                folio_client, "Test library", 10, asyncio.Semaphore(2), LogFile(), LogFile(), client
+            )
+
+            async def get_existing_users(user_objs):
+                return {("externalSystemId", "ext-1"): existing_user}
+
+            importer.get_existing_users = get_existing_users
+            await importer.process_batch(
+                [
+                    (
+                        {
+                            "externalSystemId": "ext-1",
+                            "patronGroup": "staff",
+                            "personal": {"lastName": last_name},
+                            "servicePointsUser": {},
+                        },
+                        line_number,
+                    )
+                    for line_number, last_name in enumerate(("First", "Second"))
+                ]
+            )
+            return importer
+
+    importer = asyncio.run(process_batch())
+
+    assert importer.logs["failed"] == 0
+    assert sorted(user["personal"]["lastName"] for user in updated_users) == [
+        "First",
+        "Second",
+    ]
+    assert existing_user == {
+        "id": "user-1",
+        "externalSystemId": "ext-1",
+        "personal": {"lastName": "Existing", "preferredContactTypeId": "002"},
+    }